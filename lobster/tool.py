@@ -18,9 +18,10 @@
 # <https://www.gnu.org/licenses/>.
 
 import os
+import re
 import sys
+import atexit
 import argparse
-import multiprocessing
 
 from abc import ABCMeta, abstractmethod
 from functools import partial
@@ -33,6 +34,18 @@ from lobster.io import lobster_write
 
 BUG_URL = "https://github.com/bmw-software-engineering/lobster/issues"
 
+# Per-process state of multiprocessing workers, see
+# LOBSTER_Per_File_Tool.execute.
+WORKER_STATE = {}
+
+
+def init_worker(pfun):
+    WORKER_STATE["pfun"] = pfun
+
+
+def run_worker(file_name):
+    return WORKER_STATE["pfun"](file_name)
+
 
 class LOBSTER_Tool(metaclass=ABCMeta):
     def __init__(self, name, description, extensions, official):
@@ -47,6 +60,7 @@ class LOBSTER_Tool(metaclass=ABCMeta):
         self.description = description
         self.extensions  = [".%s" % extension
                             for extension in sorted(extensions)]
+        self.ext_tuple   = tuple(self.extensions)
         self.exclude_pat = []
         self.schema      = None
         self.mh          = Message_Handler()
@@ -113,41 +127,40 @@ class LOBSTER_Tool(metaclass=ABCMeta):
             if not os.path.isfile(options.inputs_from_file):
                 self.ap.error("cannot open %s" % options.inputs_from_file)
             with open(options.inputs_from_file, "r", encoding="UTF-8") as fd:
-                for line_no, raw_line in enumerate(fd, 1):
-                    line = raw_line.split("#", 1)[0].strip()
-                    if not line:
-                        continue
-                    inputs.append((File_Reference(options.inputs_from_file,
-                                                  line_no),
-                                   line))
+                raw_lines = fd.read().split("\n")
+            for line_no, raw_line in enumerate(raw_lines, 1):
+                line = raw_line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+                inputs.append((File_Reference(options.inputs_from_file,
+                                              line_no),
+                               line))
         if not options.inputs and not options.inputs_from_file:
             inputs.append((File_Reference("<cmdline>"), "."))
 
-        # Sanity check and search directories
-        work_list = []
-        ok        = True
+        # Sanity check inputs
+        work_list   = []
+        directories = []
+        ok          = True
+        seen        = set()
         for location, item in inputs:
+            # Skip inputs we have already seen, possibly under a
+            # different name, so that they are not searched or
+            # processed twice.
+            real_path = os.path.realpath(item)
+            if real_path in seen:
+                continue
+            seen.add(real_path)
+
             if os.path.isfile(item):
-                if os.path.splitext(item)[1] not in self.extensions:
+                if not self.has_extension(item):
                     self.mh.warning(location,
                                     "not a %s file" %
                                     " or ".join(self.extensions))
                 work_list.append(item)
 
             elif os.path.isdir(item):
-                for path, dirs, files in os.walk(item):
-                    for n, dir_name in reversed(list(enumerate(dirs))):
-                        keep = True
-                        for pattern in self.exclude_pat:
-                            if pattern.match(dir_name):
-                                keep = False
-                                break
-                        if not keep:
-                            del dirs[n]
-
-                    for file_name in files:
-                        if os.path.splitext(file_name)[1] in self.extensions:
-                            work_list.append(os.path.join(path, file_name))
+                directories.append(item)
 
             else:
                 self.mh.error(location,
@@ -158,12 +171,113 @@ class LOBSTER_Tool(metaclass=ABCMeta):
         if not ok:
             sys.exit(1)
 
+        # Search directories. This is dominated by waiting for the
+        # file system, so we search several input directories at the
+        # same time.
+        if len(directories) > 1:
+            # pylint: disable=import-outside-toplevel
+            from concurrent.futures import ThreadPoolExecutor
+            max_workers = min(32,
+                              (os.cpu_count() or 1) * 4,
+                              len(directories))
+            with ThreadPoolExecutor(max_workers = max_workers) as executor:
+                for found in executor.map(self.scan_directory, directories):
+                    work_list += found
+        else:
+            for item in directories:
+                work_list += self.scan_directory(item)
+
         work_list.sort()
 
         self.process_tool_options(options, work_list)
 
         return options, work_list
 
+    def has_extension(self, file_name):
+        # The str.endswith test cheaply rejects almost all irrelevant
+        # files; os.path.splitext then makes sure that e.g. a file
+        # called just ".json" is not considered a JSON file.
+        assert isinstance(file_name, str)
+
+        return file_name.endswith(self.ext_tuple) and \
+            os.path.splitext(file_name)[1] in self.extensions
+
+    def exclude_matcher(self):
+        # Returns a function testing a directory name against all
+        # exclude patterns, or None if there are none. Where possible
+        # the patterns are fused into a single regex, so that each
+        # directory name is tested with one match call. This needs all
+        # patterns to share their flags; verbose patterns (where a
+        # comment would swallow the following alternatives) and
+        # patterns with global inline flags (which cannot be nested)
+        # are tested one by one instead.
+        if not self.exclude_pat:
+            return None
+
+        flags = set(pattern.flags for pattern in self.exclude_pat)
+        if len(flags) == 1:
+            flags = flags.pop()
+            if not flags & re.VERBOSE:
+                try:
+                    fused = re.compile(
+                        "|".join("(?:%s)" % pattern.pattern
+                                 for pattern in self.exclude_pat),
+                        flags)
+                    return fused.match
+                except re.error:
+                    pass
+
+        patterns = list(self.exclude_pat)
+        return lambda name: any(pattern.match(name) for pattern in patterns)
+
+    def scan_directory(self, root):
+        # Returns all files below root with a relevant extension. Like
+        # os.walk we do not follow symlinks to directories and ignore
+        # directories we cannot read or entries we cannot stat, but we
+        # rely on the file type reported by os.scandir instead of
+        # stat-ing every entry.
+        assert isinstance(root, str)
+
+        is_excluded = self.exclude_matcher()
+
+        found   = []
+        pending = [root]
+        while pending:
+            try:
+                scanner = os.scandir(pending.pop())
+            except OSError:
+                continue
+            with scanner:
+                while True:
+                    try:
+                        entry = next(scanner)
+                    except (StopIteration, OSError):
+                        break
+
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        if not (is_excluded and is_excluded(entry.name)):
+                            pending.append(entry.path)
+                        continue
+
+                    if not self.has_extension(entry.name):
+                        continue
+
+                    # Symlinks to directories are neither entered nor
+                    # treated as files.
+                    if entry.is_symlink():
+                        try:
+                            if entry.is_dir():
+                                continue
+                        except OSError:
+                            pass
+                    found.append(entry.path)
+
+        return found
+
     def write_output(self, ok, options, items):
         assert isinstance(ok, bool)
         assert isinstance(options, argparse.Namespace)
@@ -175,7 +289,10 @@ class LOBSTER_Tool(metaclass=ABCMeta):
 
         if ok:
             if options.out:
-                with open(options.out, "w", encoding="UTF-8") as fd:
+                # json.dump issues many small writes, use a large
+                # buffer to keep the number of system calls down.
+                with open(options.out, "w", encoding="UTF-8",
+                          buffering=1 << 20) as fd:
                     lobster_write(fd, self.schema, self.name, items)
                 print("%s: wrote %u items to %s" % (self.name,
                                                     len(items),
@@ -199,6 +316,15 @@ class LOBSTER_Tool(metaclass=ABCMeta):
 
 
 class LOBSTER_Per_File_Tool(LOBSTER_Tool):
+    # Multiprocessing pool shared by all calls of execute, and the
+    # tool and options its workers have been initialised with.
+    pool     = None
+    pool_key = None
+
+    # Common options that only matter for finding the inputs and
+    # writing the output, and are therefore not given to process.
+    NON_WORKER_OPTIONS = ("out", "inputs", "inputs_from_file")
+
     def __init__(self, name, description, extensions, official=False):
         super().__init__(name, description, extensions, official)
 
@@ -213,21 +339,84 @@ class LOBSTER_Per_File_Tool(LOBSTER_Tool):
     def process(cls, options, file_name):
         return True, []
 
+    def worker_options(self, options):
+        assert isinstance(options, argparse.Namespace)
+
+        return argparse.Namespace(**{
+            name: value
+            for name, value in vars(options).items()
+            if name not in self.NON_WORKER_OPTIONS})
+
+    @staticmethod
+    def shutdown_pool():
+        pool = LOBSTER_Per_File_Tool.pool
+        if pool is not None:
+            LOBSTER_Per_File_Tool.pool     = None
+            LOBSTER_Per_File_Tool.pool_key = None
+            pool.terminate()
+
+    def get_pool(self, options):
+        # Starting the workers is expensive (each has to import the
+        # tool again), so the pool is kept until the end of the
+        # process and re-used when execute is called again. Since the
+        # workers are initialised with the tool and its options, a
+        # pool can only be re-used for the same tool and options (as
+        # returned by worker_options).
+        assert isinstance(options, argparse.Namespace)
+
+        # Only import multiprocessing when we actually use it, to
+        # keep the start-up of the tools short.
+        # pylint: disable=import-outside-toplevel
+        import multiprocessing
+
+        key = (type(self), dict(vars(options)))
+        if LOBSTER_Per_File_Tool.pool_key != key:
+            LOBSTER_Per_File_Tool.shutdown_pool()
+
+        if LOBSTER_Per_File_Tool.pool is None:
+            # The options are sent to each worker only once, when it
+            # starts, so that each chunk of work just carries file
+            # names. The pool deliberately outlives this call, it is
+            # shut down by shutdown_pool.
+            # pylint: disable=consider-using-with
+            LOBSTER_Per_File_Tool.pool = multiprocessing.Pool(
+                initializer = init_worker,
+                initargs    = (partial(self.process, options),))
+            LOBSTER_Per_File_Tool.pool_key = key
+
+        return LOBSTER_Per_File_Tool.pool
+
     def execute(self):
         options, work_list = self.process_commandline_options()
+        worker_options = self.worker_options(options)
 
         ok    = True
         items = []
-        pfun  = partial(self.process, options)
-        if options.single:
+        if worker_options.single:
+            pfun = partial(self.process, worker_options)
             for file_name in work_list:
                 new_ok, new_items = pfun(file_name)
                 ok    &= new_ok
                 items += new_items
         else:
-            with multiprocessing.Pool() as pool:
-                for new_ok, new_items in pool.imap(pfun, work_list, 4):
+            # Hand out work in a few larger chunks per worker to keep
+            # the IPC overhead down. We use the ordered imap so that
+            # the output does not depend on scheduling.
+            chunksize = max(1, len(work_list) // ((os.cpu_count() or 1) * 4))
+            pool      = self.get_pool(worker_options)
+            try:
+                for new_ok, new_items in pool.imap(run_worker,
+                                                   work_list,
+                                                   chunksize):
                     ok    &= new_ok
                     items += new_items
+            except BaseException:
+                # Do not leave the workers busy with the remaining
+                # chunks, and do not re-use a pool in unknown state.
+                LOBSTER_Per_File_Tool.shutdown_pool()
+                raise
 
         return self.write_output(ok, options, items)
+
+
+atexit.register(LOBSTER_Per_File_Tool.shutdown_pool)
@@ -0,0 +1,179 @@
+import unittest
+import os
+import re
+import sys
+import tempfile
+from unittest import mock
+
+from lobster.tool import LOBSTER_Per_File_Tool
+from lobster.items import Activity
+
+
+class Dummy_Tool(LOBSTER_Per_File_Tool):
+    def __init__(self):
+        super().__init__(
+            name        = "dummy",
+            description = "Tool used for testing.",
+            extensions  = ["json"])
+        self.add_argument("--flag",
+                          default = False,
+                          action  = "store_true")
+
+    def process_tool_options(self, options, work_list):
+        self.schema = Activity
+        return True
+
+    @classmethod
+    def process(cls, options, file_name):
+        assert not hasattr(options, "out")
+        return True, []
+
+
+class Test_Pool(unittest.TestCase):
+    def setUp(self):
+        # pylint: disable=consider-using-with
+        self.tmp = tempfile.TemporaryDirectory()
+        for name in ("a.json", "b.json"):
+            with open(os.path.join(self.tmp.name, name), "w",
+                      encoding="UTF-8") as fd:
+                fd.write("{}\n")
+
+    def tearDown(self):
+        LOBSTER_Per_File_Tool.shutdown_pool()
+        self.tmp.cleanup()
+
+    def execute(self, *args):
+        argv = ["lobster-dummy",
+                "--out", os.path.join(self.tmp.name, "out.lobster")]
+        argv += list(args)
+        with mock.patch.object(sys, "argv", argv), \
+             mock.patch("builtins.print"):
+            self.assertEqual(Dummy_Tool().execute(), 0)
+        return LOBSTER_Per_File_Tool.pool
+
+    def testReuse(self):
+        a_json = os.path.join(self.tmp.name, "a.json")
+        b_json = os.path.join(self.tmp.name, "b.json")
+
+        pool = self.execute(a_json)
+        self.assertIsNotNone(pool)
+
+        # Different inputs and output re-use the pool
+        self.assertIs(self.execute(b_json), pool)
+        self.assertIs(self.execute("--out",
+                                   os.path.join(self.tmp.name, "x.lobster"),
+                                   a_json, b_json),
+                      pool)
+
+    def testInvalidate(self):
+        a_json = os.path.join(self.tmp.name, "a.json")
+
+        pool = self.execute(a_json)
+
+        # Different tool options need a new pool
+        new_pool = self.execute("--flag", a_json)
+        self.assertIsNot(new_pool, pool)
+        self.assertIs(self.execute("--flag", a_json), new_pool)
+
+    def testSingle(self):
+        a_json = os.path.join(self.tmp.name, "a.json")
+
+        self.assertIsNone(self.execute("--single", a_json))
+
+
+class Test_Scan(unittest.TestCase):
+    def setUp(self):
+        # pylint: disable=consider-using-with
+        self.tmp  = tempfile.TemporaryDirectory()
+        self.tool = Dummy_Tool()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def create(self, *names):
+        for name in names:
+            file_name = os.path.join(self.tmp.name, *name.split("/"))
+            os.makedirs(os.path.dirname(file_name), exist_ok=True)
+            with open(file_name, "w", encoding="UTF-8") as fd:
+                fd.write("{}\n")
+
+    def scan(self):
+        return sorted(os.path.relpath(file_name, self.tmp.name)
+                      .replace(os.sep, "/")
+                      for file_name in self.tool.scan_directory(self.tmp.name))
+
+    def testExclude(self):
+        self.create("a/a.json", "bazel-out/b.json", "sub/c.json", "d.json")
+        self.tool.exclude_pat = [re.compile(r"^bazel-.*$"),
+                                 re.compile("sub")]
+        self.assertEqual(self.scan(), ["a/a.json", "d.json"])
+
+    def testExcludeFlags(self):
+        self.create("a/a.json", "sub/c.json", "SUB2/d.json")
+        self.tool.exclude_pat = [re.compile("SUB", re.IGNORECASE)]
+        self.assertEqual(self.scan(), ["a/a.json"])
+
+        self.tool.exclude_pat = [re.compile("(?i)SUB")]
+        self.assertEqual(self.scan(), ["a/a.json"])
+
+        self.tool.exclude_pat = [re.compile("SUB"),
+                                 re.compile("A", re.IGNORECASE)]
+        self.assertEqual(self.scan(), ["sub/c.json"])
+
+        self.tool.exclude_pat = [re.compile("(?i)a"),
+                                 re.compile("(?i)sub2")]
+        self.assertEqual(self.scan(), ["sub/c.json"])
+
+        self.tool.exclude_pat = [re.compile("a  # comment", re.VERBOSE),
+                                 re.compile("sub", re.VERBOSE)]
+        self.assertEqual(self.scan(), ["SUB2/d.json"])
+
+    def testExtension(self):
+        self.create("a.json", ".json", "b.json.bak", "c.JSON", "d/.e.json")
+        self.assertEqual(self.scan(), ["a.json", "d/.e.json"])
+
+    def testSymlinks(self):
+        self.create("a/a.json", "b.json")
+        try:
+            os.symlink("a", os.path.join(self.tmp.name, "link"),
+                       target_is_directory = True)
+        except OSError:
+            self.skipTest("cannot create symlinks")
+        os.symlink("a", os.path.join(self.tmp.name, "dir.json"),
+                   target_is_directory = True)
+        os.symlink("b.json", os.path.join(self.tmp.name, "l.json"))
+        os.symlink("missing.json", os.path.join(self.tmp.name, "x.json"))
+        os.symlink("self", os.path.join(self.tmp.name, "self"))
+        os.symlink("loop.json", os.path.join(self.tmp.name, "loop.json"))
+
+        # Like os.walk: symlinks to directories are neither entered
+        # nor listed, all other symlinks are listed like files, even
+        # if they cannot be resolved.
+        self.assertEqual(self.scan(), ["a/a.json",
+                                       "b.json",
+                                       "l.json",
+                                       "loop.json",
+                                       "x.json"])
+
+    def testUnreadable(self):
+        self.create("a/a.json", "b/b.json")
+        unreadable = os.path.join(self.tmp.name, "a")
+        scandir    = os.scandir
+
+        def mock_scandir(path):
+            if path == unreadable:
+                raise PermissionError(path)
+            return scandir(path)
+
+        with mock.patch("lobster.tool.os.scandir", mock_scandir):
+            self.assertEqual(self.scan(), ["b/b.json"])
+
+    def testFileInputExtension(self):
+        self.create("a.json", ".json")
+        for name, warned in (("a.json", False),
+                             (".json", True)):
+            argv = ["lobster-dummy", os.path.join(self.tmp.name, name)]
+            with mock.patch.object(sys, "argv", argv), \
+                 mock.patch.object(self.tool.mh, "warning") as warning:
+                self.tool.process_commandline_options()
+            self.assertEqual(warning.called, warned)